@@ -8,34 +8,77 @@ from micropython import const
 import adafruit_imageload
 
 
+# Sprite sheet range. Underscore-prefixed const() names at module scope get
+# left out of the module's globals dict, so they cost no RAM at runtime.
+_ASCII_SPACE = const(32)  # first sprite: space (blank rectangle)
+_ASCII_DEL   = const(127)  # last sprite: DEL (up/down arrows)
+_ASCII_QMARK = const(63)  # '?' (substitute for out of range chars)
+_QMARK_SPRITE = const(_ASCII_QMARK - _ASCII_SPACE)  # sprite number of '?'
+
+# Lookup table to translate byte values to sprite numbers. The spritesheet
+# starts at ' ', so subtract _ASCII_SPACE, and out of range bytes get the '?'
+# sprite.
+_XLAT = bytes([
+    (n - _ASCII_SPACE) if (_ASCII_SPACE <= n <= _ASCII_DEL) else _QMARK_SPRITE
+    for n in range(256)])
+
+
+# Font sprite sheet (cached here after the first CharLCD loads it)
+_BMP = None
+_PAL = None
+
+
 class CharLCD:
     # Simulate a dot matrix character LCD using sprites
 
-    def __init__(self, cols=8, x=0, y0=0, y1=32, scale=2):
+    def __init__(self, cols=8, x=0, y0=0, y1=32, scale=2, bitmap=None,
+        palette=None):
         # Args:
-        # -  cols: number of columns (monospace characters) in the display
-        # -     x: x coordinate of both lines' top-left corners
-        # -    y0: y coordinate of top line's top-left corner
-        # -    y1: y coordinate of bottom lines's top-left corner
-        # - scale: scaling factor for the font (scale=2 means 2x zoom)
+        # -    cols: number of columns (monospace characters) in the display
+        # -       x: x coordinate of both lines' top-left corners
+        # -      y0: y coordinate of top line's top-left corner
+        # -      y1: y coordinate of bottom lines's top-left corner
+        # -   scale: scaling factor for the font (scale=2 means 2x zoom)
+        # -  bitmap: optional font Bitmap to reuse (skips loading the file)
+        # - palette: font Palette to go with bitmap (pass both or neither)
         self.cols = cols
-        # Load font spritesheet into Bitmap and Palette objects
-        gc.collect()
-        (bmp, pal) = adafruit_imageload.load(
-            "ascii-font.bmp", bitmap=Bitmap, palette=Palette)
-        gc.collect()
+        # Load font spritesheet into Bitmap and Palette objects (just once)
+        global _BMP, _PAL
+        if (bitmap is None) != (palette is None):
+            raise ValueError("bitmap and palette must be passed together")
+        if bitmap is None:
+            if _BMP is None:
+                gc.collect()
+                (_BMP, _PAL) = adafruit_imageload.load(
+                    "ascii-font.bmp", bitmap=Bitmap, palette=Palette)
+                gc.collect()
+            (bitmap, palette) = (_BMP, _PAL)
         # Make a Group with TileGrids for the top line, with top left corner at
         # (x0, y0), and the bottom line, with top left corner at (x1, y1)
         tg0 = TileGrid(
-            bmp, pixel_shader=pal, width=cols, height=1,
+            bitmap, pixel_shader=palette, width=cols, height=1,
             tile_width=6, tile_height=8, x=x, y=y0, default_tile=0)
-        gc.collect()
         tg1 = TileGrid(
-            bmp, pixel_shader=pal, width=cols, height=1,
+            bitmap, pixel_shader=palette, width=cols, height=1,
             tile_width=6, tile_height=8, x=x, y=y1, default_tile=0)
         gc.collect()
         self.tg0 = tg0
         self.tg1 = tg1
+        # Row buffer for building sprite numbers, plus shadow copies of what
+        # each TileGrid currently shows (0 is space, matching default_tile)
+        self._row = bytearray(cols)
+        self._prev0 = bytearray(cols)
+        self._prev1 = bytearray(cols)
+        # Length of the last message shown on each line (everything to the
+        # right of that is already known to be blank)
+        self._end0 = 0
+        self._end1 = 0
+        # Last message shown on each line, if it was immutable (bytes or str),
+        # so that repeating the same message can return right away
+        self._msg0 = None
+        self._msg1 = None
+        # Set when setMsg() changes a sprite (code.py clears it on refresh)
+        self.dirty = False
         g = Group(scale=scale)
         g.append(tg0)
         g.append(tg1)
@@ -49,24 +92,57 @@ class CharLCD:
         # - msg: string or bytes (should have ASCII chars in range 32..127)
         # - top: True: show msg on top line; False: show msg on bottom line
         #
-        ASCII_SPACE = const(32)  # first sprite: space (blank rectangle)
-        ASCII_DEL = const(127)   # last sprite: DEL (up/down arrows)
+        # Skip everything if the line already shows this message. Comparing
+        # bytes is one C call, which is much cheaper than the loops below.
+        if msg == (self._msg0 if top else self._msg1):
+            return
         _tg = self.tg0 if top else self.tg1
+        _prev = self._prev0 if top else self._prev1
+        _row = self._row
         _cols = self.cols
+        _ord = ord
+        _xlat = _XLAT
 
-        # Set sprites for characters of the message (max length = self.cols)
-        for (i, char) in zip(range(_cols), msg):
-            # Convert the character to a sprite number and update the TileGrid
-            n = char if (type(char) == int) else ord(char)
-            if (n < ASCII_SPACE) or (ASCII_DEL < n):
-                n = ord('?')  # Replace out of range chars with '?'
-            # Change sprite if current value differs from previous value
-            sprite = n - 32      # spritesheet starts at ' ', so subtract 32
-            if _tg[i] != sprite:
-                _tg[i] = sprite
+        # Build sprite numbers for the whole row (max length = self.cols).
+        # This indexes msg with a range() loop rather than slicing or using
+        # enumerate(), so that bytes messages don't allocate any heap memory.
+        # The str vs. bytes check happens once here, outside the loops.
+        end = min(len(msg), _cols)
+        if msg.__class__ is str:
+            # Convert characters to sprite numbers by table lookup
+            for i in range(end):
+                n = _ord(msg[i])
+                _row[i] = _xlat[n] if (n < 256) else _QMARK_SPRITE
+        else:
+            # Items of bytes, bytearray, or memoryview are already ints
+            for i in range(end):
+                _row[i] = _xlat[msg[i]]
 
-        # Clear right padding area with space characters
-        for i in range(len(msg), _cols):
-            if _tg[i] != 0:
-                _tg[i] = 0   # spritesheet starts at ' ', so 0 is space
+        # Right padding area gets space characters, but only out to the end
+        # of the previous message. Past that, the line is already blank.
+        prevEnd = self._end0 if top else self._end1
+        stop = end if (end > prevEnd) else prevEnd
+        for i in range(end, stop):
+            _row[i] = 0          # spritesheet starts at ' ', so 0 is space
+        # Remember the message for next time, but only if it can't change
+        # later (a bytearray could be modified after being shown)
+        cls = msg.__class__
+        keep = msg if ((cls is bytes) or (cls is str)) else None
+        if top:
+            self._end0 = end
+            self._msg0 = keep
+        else:
+            self._end1 = end
+            self._msg1 = keep
 
+        # Push the row to the TileGrid, but only write sprites that differ
+        # from the shadow copy (avoids redundant calls into displayio)
+        dirty = False
+        for i in range(stop):
+            sprite = _row[i]
+            if _prev[i] != sprite:
+                _tg[i] = sprite
+                _prev[i] = sprite
+                dirty = True
+        if dirty:
+            self.dirty = True
@@ -27,72 +27,140 @@
 # - https://learn.adafruit.com/adafruit-adalogger-featherwing/rtc-with-circuitpython
 # - https://docs.circuitpython.org/en/latest/shared-bindings/time/index.html
 #
-from board import D9, D10, D11, I2C, SPI, TFT_CS, TFT_DC
-from digitalio import DigitalInOut, Direction
-from displayio import Bitmap, Group, Palette, TileGrid, release_displays
+from board import D9, D10, I2C, SPI, TFT_CS, TFT_DC
+from displayio import Group, release_displays
 from fourwire import FourWire
 import gc
-from max3421e import Max3421E
 from micropython import const
 from supervisor import ticks_ms
 from time import sleep, struct_time
 from usb.core import USBError
 
-from adafruit_pcf8523 import PCF8523
-from adafruit_st7789 import ST7789
-from charlcd import CharLCD
-from gamepad import (
-    XInputGamepad, UP, DOWN, LEFT, RIGHT, START, SELECT, A, B, X, Y)
-from sevenseg import SevenSeg
+from gamepad import XInputGamepad, UP, DOWN, LEFT, RIGHT, START, A, B
 from statemachine import StateMachine
 
 
-def handle_input(machine, prev, buttons, repeat):
-    # Respond to gamepad button state change events
-    diff = prev ^  buttons
-    mh = machine.handleGamepad
-    #print(f"{buttons:016b}")
+# Set DEBUG to 1 to log gamepad button bits and connection status changes to
+# the serial console. With DEBUG = 0, the compiler drops the `if DEBUG:`
+# blocks entirely.
+DEBUG = const(0)
+
+# Display geometry. The ST7789 display has a native size of 240x135px.
+TFT_W = const(240)
+TFT_H = const(135)
+# Character display areas at top and bottom of screen (6x8 px font)
+SCALE = const(2)
+PAD   = const(2)
+COLS  = const(20)
+Y1    = const((TFT_H // SCALE) - 8 - PAD)
+# 7-segment clock digits area (eight sprites, each 30px wide by 50px high)
+DIGITS_X = const((TFT_W - (8 * 30)) // 2)
+DIGITS_Y = const((TFT_H - 50) // 2)
+
+# The supervisor.ticks_ms() counter rolls over at 2**29, and
+# (2**29)-1 = 0x3fffffff
+TICKS_MASK = const(0x3fffffff)
+
+
+# Maps from single gamepad button bitmask values to StateMachine button codes.
+# Edge events look up each newly pressed button's bit on its own, so pressing
+# A and B in the same report sends both events.
+_PRESS = {
+    A: StateMachine.A, B: StateMachine.B, UP: StateMachine.UP,
+    DOWN: StateMachine.DOWN, LEFT: StateMachine.LEFT,
+    RIGHT: StateMachine.RIGHT, START: StateMachine.START}
+_HOLD = {UP: StateMachine.UP, DOWN: StateMachine.DOWN}
+
+# Flags for pending display work, matching StateMachine.handleGamepad()'s
+# return codes. CAUTION: These values must match StateMachine.REDRAW and
+# StateMachine.RTC_SET.
+_REDRAW  = const(1)  # redraw digits from the cached struct_time
+_RTC_SET = const(2)  # read the RTC before redrawing digits
 
+
+def handle_input(mh, prev, buttons, repeat):
+    # Respond to gamepad button state change events
+    # - mh: the StateMachine's bound handleGamepad method (resolved once by
+    #   the caller, rather than once per event here)
+    # Returns: 0, or StateMachine.handleGamepad() return codes ORed together
+    if DEBUG:
+        print(f"{buttons:016b}")
     if repeat:
-        # Check for hold-time triggered repeating events
-        if (buttons == UP):        # UP held
-            mh(machine.UP, True)
-        elif (buttons == DOWN):    # DOWN held
-            mh(machine.DOWN, True)
-    else:
-        # Check for edge-triggered events
-        if (diff & A) and (buttons == A):  # A pressed
-            mh(machine.A, False)
-        elif (diff & B) and (buttons == B):  # B pressed
-            mh(machine.B, False)
-        elif (diff & UP) and (buttons == UP):  # UP pressed
-            mh(machine.UP, False)
-        elif (diff & DOWN) and (buttons == DOWN):  # DOWN pressed
-            mh(machine.DOWN, repeat)
-        elif (diff & LEFT) and (buttons == LEFT):  # LEFT pressed
-            mh(machine.LEFT, False)
-        elif (diff & RIGHT) and (buttons == RIGHT):  # RIGHT pressed
-            mh(machine.RIGHT, False)
-        elif (diff & START) and (buttons == START):  # START pressed
-            mh(machine.START, False)
+        # Check for hold-time triggered repeating events (UP or DOWN held)
+        code = _HOLD.get(buttons)
+        if code is None:
+            return 0
+        return mh(code, True)
+    # Check for edge-triggered events. One XOR and one AND give the bits for
+    # buttons that changed and are now pressed. Then, dispatch each of those
+    # bits, lowest first (x & -x isolates the lowest set bit of x).
+    pressed = (prev ^ buttons) & buttons
+    result = 0
+    while pressed:
+        bit = pressed & -pressed
+        pressed ^= bit
+        code = _PRESS.get(bit)
+        if code is not None:
+            result |= mh(code, False)
+    return result
 
 
 def elapsed_ms(prev, now):
     # Calculate elapsed ms between two timestamps from supervisor.ticks_ms().
-    # The ticks counter rolls over at 2**29, and (2**29)-1 = 0x3fffffff
-    MASK = const(0x3fffffff)
-    return (now - prev) & MASK
+    return (now - prev) & TICKS_MASK
+
+
+# PCF8523 Seconds register address, which is the first of the seven BCD time
+# registers (Seconds, Minutes, Hours, Days, Weekdays, Months, Years)
+_RTC_SECONDS = b'\x03'
+
+
+def read_rtc(i2c_device, buf):
+    # Read the RTC time registers into buf (bytearray(7)) with one I2C burst
+    # read. Returns hours, minutes, and seconds as BCD packed into an int.
+    # Unlike rtc.datetime, this doesn't allocate a struct_time, which matters
+    # because most polls find the time hasn't changed yet.
+    with i2c_device as i2c:
+        i2c.write_then_readinto(_RTC_SECONDS, buf)
+    return ((buf[2] & 0x3f) << 16) | ((buf[1] & 0x7f) << 8) | (buf[0] & 0x7f)
+
+
+def bcd(n):
+    # Convert a binary coded decimal byte to an int
+    return ((n >> 4) * 10) + (n & 0x0f)
+
+
+def rtc_struct_time(buf):
+    # Decode time registers from read_rtc() into a struct_time, matching the
+    # fields that rtc.datetime would give
+    return struct_time((
+        2000 + bcd(buf[6]), bcd(buf[5] & 0x1f), bcd(buf[3] & 0x3f),
+        bcd(buf[2] & 0x3f), bcd(buf[1] & 0x7f), bcd(buf[0] & 0x7f),
+        buf[4] & 0x07, -1, -1))
 
 
 def main():
     release_displays()
     gc.collect()
+    # Import the display driver and sprite widgets (which pull in
+    # adafruit_imageload) only after the old display has been released and
+    # the heap collected. That gives their large Bitmap allocations a better
+    # chance of finding contiguous free memory.
+    from adafruit_st7789 import ST7789
+    from charlcd import CharLCD
+    from sevenseg import SevenSeg
+    gc.collect()
     spi = SPI()
 
     # Initialize ST7789 display with native display size of 240x135px.
-    TFT_W = const(240)
-    TFT_H = const(135)
-    bus = FourWire(spi, command=TFT_DC, chip_select=TFT_CS)
+    # The core already pushes refresh pixels with SPI DMA, so the useful knob
+    # here is the bus clock. The default is 24MHz, and the ST7789's 16ns
+    # write cycle allows up to 62.5MHz. The ESP32-S3 derives SPI clocks from
+    # 80MHz by integer division, so anything from 40MHz up to 80MHz rounds
+    # down to 40MHz, and 80MHz itself is out of spec for the ST7789. That
+    # makes 40MHz the fastest usable setting.
+    bus = FourWire(spi, command=TFT_DC, chip_select=TFT_CS,
+        baudrate=40_000_000)
     display = ST7789(bus, rotation=270, width=TFT_W, height=TFT_H, rowstart=40,
         colstart=53, auto_refresh=False)
     gc.collect()
@@ -101,23 +169,16 @@ def main():
 
     # Configure the character display areas at top and bottom of screen.
     # This uses a 6x8 px spritesheet font for ASCII characters (32..127).
-    SCALE = 2
-    PAD = 2
-    COLS = 20
-    Y1 = (TFT_H // SCALE) - 8 - PAD
     charLCD = CharLCD(cols=COLS, x=0, y0=PAD, y1=Y1, scale=SCALE)
     gc.collect()
 
     # Configure the 7-segment clock digits display area in the center of the
     # screen. There are eight 7-segment sprites, and each sprite is 30px wide by
     # 50px high.
-    X = (TFT_W - (8 * 30)) // 2
-    Y = (TFT_H - 50) // 2
-    digits = SevenSeg(x=X, y=Y)
+    digits = SevenSeg(x=DIGITS_X, y=DIGITS_Y)
     gc.collect()
 
     # Add the TileGrids to the display's root group
-    gc.collect()
     grp = Group(scale=1)
     grp.append(charLCD.group())
     grp.append(digits.group())
@@ -127,13 +188,18 @@ def main():
     # Initialize MAX3421E USB host chip which is needed by usb.core.
     # The link between usb.core and Max3421E happens by way of invisible
     # magic in the CircuitPython core, kinda like with displayio displays.
+    # NOTE: The core claims the D9 IRQ pin here, so Python code can't watch
+    # it with DigitalInOut, countio, or alarm. Instead, the inner loop gets
+    # paced by the short read timeout that XInputGamepad.poll() uses.
     print("Initializing USB host port...")
+    from max3421e import Max3421E
     gc.collect()
     usbHost = Max3421E(spi, chip_select=D10, irq=D9)
     gc.collect()
     sleep(0.1)
 
     # Initialize RTC
+    from adafruit_pcf8523 import PCF8523
     rtc = PCF8523.PCF8523(I2C())
     print("RTC calibration:", rtc.calibration)
     gc.collect()
@@ -143,70 +209,114 @@ def main():
     # Initialize State Machine
     machine = StateMachine(digits, charLCD, rtc)
 
-    # Gamepad status update strings
-    GP_FIND   = 'Finding USB gamepad'
-    GP_READY  = 'gamepad ready'
-    GP_DISCON = 'gamepad disconnected'
-    GP_ERR    = 'gamepad connection error'
+    # Gamepad status update messages. These are bytes so setMsg() can use
+    # its allocation free path, and the serial console copies of them only
+    # get printed when DEBUG is set.
+    GP_FIND   = b'Finding USB gamepad'
+    GP_READY  = b'gamepad ready'
+    GP_DISCON = b'gamepad disconnected'
+    GP_ERR    = b'gamepad connection error'
 
     # Cache frequently used callables to save time on dictionary name lookups
-    # NOTE: rtc.datetime is a property, so we can't cache it here!
     _collect = gc.collect
     _elapsed = elapsed_ms
+    _handle = handle_input
+    _mh = machine.handleGamepad
     _ms = ticks_ms
     _refresh = display.refresh
     _setMsg = charLCD.setMsg
     _updateDigits = machine.updateDigits
 
-    # Read RTC time and update display digits
-    prevST = rtc.datetime
+    # Read RTC time and update display digits. Polling reads the RTC's time
+    # registers directly into rtc_buf, giving hours, minutes, and seconds
+    # packed into one int. That makes checking for a change a single int
+    # compare, and a struct_time only gets built when the time has changed.
+    _i2c = rtc.i2c_device
+    _readRTC = read_rtc
+    rtc_buf = bytearray(7)
+    prev_hms = _readRTC(_i2c, rtc_buf)
+    prevST = rtc_struct_time(rtc_buf)
     _updateDigits(prevST)
 
     # MAIN EVENT LOOP
     # Establish and maintain a gamepad connection
     gp = XInputGamepad()
-    print(GP_FIND)
+    if DEBUG:
+        print(GP_FIND.decode())
     _setMsg(GP_FIND, top=False)
-    _refresh()
-    need_refresh = False
+    # Display refreshes are coalesced: sprite setters mark their widget
+    # dirty, and each loop iteration ends with at most one display.refresh(),
+    # only if a widget's sprites actually changed. Separately, pending holds
+    # _REDRAW and _RTC_SET flags from input events. A state change only needs
+    # the digits redrawn from the cached time, so only an RTC change costs an
+    # I2C read outside of the regular polling schedule.
+    pending = 0
     # OUTER LOOP: Update clock and try to connect to a USB gamepad.
     # Start timers for RTC polling and gamepad button hold detection. The point
     # the RTC timer is to avoid burning unecessary clock cycles waiting for the
-    # I2C bus, which is slow.
+    # I2C bus, which is slow. Polling adapts to the seconds edge, so steady
+    # state is about one or two I2C reads per second instead of ten.
     RTC_MS    = const(100)  # RTC poll interval (ms)
+    SEC_MS    = const(950)  # RTC poll interval after seconds changed (ms)
     DELAY_MS  = const(900)  # Gamepad button hold delay before repeat (ms)
     REPEAT_MS = const(300)  # Gamepad button interval between repeats (ms)
+    FIND_MS   = const(100)  # First gamepad search retry interval (ms)
+    FIND_MAX  = const(1000)  # Longest gamepad search retry interval (ms)
+    GC_EVERY  = const(10)   # Outer loop passes between gc.collect() calls
     prev_ms = _ms()
     rtc_ms = 0
+    rtc_wait = RTC_MS
     hold_tmr = 0
     repeat_tmr = 0
+    find_ms = 0
+    find_wait = 0
+    gc_count = 0
     while True:
-        _collect()
+        # Collect garbage about once per second while searching for a
+        # gamepad, rather than on every pass (a collection walks the whole
+        # heap). The inner gamepad loop does its own collections.
+        gc_count += 1
+        if gc_count >= GC_EVERY:
+            gc_count = 0
+            _collect()
         now_ms = _ms()
-        if need_refresh or (_elapsed(rtc_ms, now_ms) >= RTC_MS):
-            # Check clock (RTC) and update time display if needed
+        if _elapsed(rtc_ms, now_ms) >= rtc_wait:
+            # Check clock (RTC) and update time display if needed. The time
+            # only changes once per second, so right after seeing the seconds
+            # change, wait until just before the next change to poll again.
             rtc_ms = now_ms
-            nowST = rtc.datetime
-            if need_refresh or (nowST != prevST):
-                prevST = nowST
+            hms = _readRTC(_i2c, rtc_buf)
+            rtc_wait = SEC_MS if (hms != prev_hms) else RTC_MS
+            if hms != prev_hms:
+                prevST = rtc_struct_time(rtc_buf)
+                prev_hms = hms
                 _updateDigits(prevST)
-                _refresh()
-                need_refresh = False
+        # Refresh the display at most once per loop iteration
+        if charLCD.dirty or digits.dirty:
+            _refresh()
+            charLCD.dirty = False
+            digits.dirty = False
         try:
-            # Attempt to connect to USB gamepad
-            if gp.find_and_configure():
-                print(gp.device_info_str())
-                connected = True
+            # Attempt to connect to USB gamepad. Each failed attempt doubles
+            # the time until the next one (up to FIND_MAX), since searching
+            # means SPI traffic to the MAX3421E. The clock keeps updating at
+            # the usual rate in the meantime.
+            if _elapsed(find_ms, now_ms) < find_wait:
+                sleep(0.1)
+            elif gp.find_and_configure():
+                if DEBUG:
+                    print(gp.device_info_str())
                 _setMsg(GP_READY, top=False)
-                _refresh()
                 # INNER LOOP: Update clock and poll gamepad for button events
                 prev_btn = 0
                 hold_tmr = 0
                 repeat_tmr = 0
+                new_sec = False
                 for buttons in gp.poll():
                     # Update timers
                     now_ms = _ms()
-                    interval = _elapsed(prev_ms, now_ms)
+                    # (elapsed_ms() is inlined in this loop to save calls)
+                    interval = (now_ms - prev_ms) & TICKS_MASK
                     prev_ms = now_ms
                     if buttons == 0:
                         hold_tmr = 0
@@ -217,51 +327,74 @@ def main():
                     else:
                         hold_tmr += interval
                         repeat_tmr += interval
-                    # Check RTC and update display if needed
-                    if need_refresh or (_elapsed(rtc_ms, now_ms) >= RTC_MS):
-                        rtc_ms = now_ms
-                        nowST = rtc.datetime
-                        if need_refresh or (nowST != prevST):
-                            prevST = nowST
-                            _updateDigits(prevST)
-                            _refresh()
-                            _collect()
-                            need_refresh = False
                     # Handle hold-time triggered gamepad input events
                     if hold_tmr >= DELAY_MS:
                         if hold_tmr == repeat_tmr:
                             # First re-trigger event after initial delay
                             repeat_tmr -= DELAY_MS
-                            handle_input(machine, prev_btn, buttons, True)
-                            need_refresh = True
+                            pending |= _handle(_mh, prev_btn, buttons, True)
                         elif repeat_tmr >= REPEAT_MS:
                             # Another re-trigger event after repeat interval
                             repeat_tmr -= REPEAT_MS
-                            handle_input(machine, prev_btn, buttons, True)
-                            need_refresh = True
-                    # Handle edge-triggered gamepad input events
-                    if prev_btn != buttons:
-                        handle_input(machine, prev_btn, buttons, False)
-                        need_refresh = True
+                            pending |= _handle(_mh, prev_btn, buttons, True)
+                    # Handle edge-triggered gamepad input events. Only new
+                    # presses matter, so skip the call for releases too.
+                    if (prev_btn ^ buttons) & buttons:
+                        pending |= _handle(_mh, prev_btn, buttons, False)
+                    # Check RTC and update digits if needed. This comes after
+                    # input handling so a button event gets its new digits
+                    # in the same frame as its new status messages.
+                    if (pending & _RTC_SET) or (
+                        ((now_ms - rtc_ms) & TICKS_MASK) >= rtc_wait):
+                        rtc_ms = now_ms
+                        hms = _readRTC(_i2c, rtc_buf)
+                        new_sec = hms != prev_hms
+                        rtc_wait = SEC_MS if new_sec else RTC_MS
+                        if (pending & _RTC_SET) or new_sec:
+                            prevST = rtc_struct_time(rtc_buf)
+                            prev_hms = hms
+                            pending = _REDRAW
+                    if pending:
+                        _updateDigits(prevST)
+                        pending = 0
+                    # Refresh the display at most once per loop iteration
+                    if charLCD.dirty or digits.dirty:
+                        _refresh()
+                        charLCD.dirty = False
+                        digits.dirty = False
+                    # Collect garbage once per second, right after the new
+                    # second's frame is drawn. Button reports and the
+                    # struct_time for each second allocate a little, so
+                    # without this, a collection would happen whenever the
+                    # heap filled up, which could be in the middle of input.
+                    if new_sec:
+                        new_sec = False
+                        _collect()
                     # Save button values
                     prev_btn = buttons
                 # If loop stopped, gamepad connection was lost
-                print(GP_DISCON)
-                print(GP_FIND)
+                if DEBUG:
+                    print(GP_DISCON.decode())
+                    print(GP_FIND.decode())
                 _setMsg(GP_FIND, top=False)
-                _refresh()
+                find_wait = 0
             else:
-                # No connection yet, so sleep briefly then try again
+                # No connection yet, so back off, sleep briefly, then go on
+                find_ms = now_ms
+                find_wait = (min(find_wait * 2, FIND_MAX) if find_wait
+                    else FIND_MS)
                 sleep(0.1)
         except USBError as e:
             # This might mean gamepad was unplugged, or maybe some other
             # low-level USB thing happened which this driver does not yet
-            # know how to deal with. So, log the error and keep going
-            print(e)
-            print(GP_ERR)
-            print(GP_FIND)
+            # know how to deal with. So, log the error (if DEBUG is set)
+            # and keep going
+            if DEBUG:
+                print(e)
+                print(GP_ERR.decode())
+                print(GP_FIND.decode())
             _setMsg(GP_FIND, top=False)
-            _refresh()
+            find_wait = 0
 
 
 main()
@@ -58,8 +58,11 @@ class XInputGamepad:
         # Exceptions: may raise usb.core.USBError or usb.core.USBTimeoutError
         #
         device = core.find(idVendor=0x045e, idProduct=0x028e)
-        sleep(0.1)
         if device:
+            # Give the new device a moment to settle before configuring it.
+            # (When nothing is plugged in, don't add a fixed delay here. The
+            # caller decides how long to wait between attempts.)
+            sleep(0.1)
             self._configure(device)  # may raise usb.core.USBError
             return True              # end retry loop
         else:
@@ -8,14 +8,38 @@ from micropython import const
 import adafruit_imageload
 
 
+# Character and sprite constants
+_ASCII_DASH   = const(45)
+_ASCII_ZERO   = const(48)
+_ASCII_COLON  = const(58)  # conveniently, ASCII ":" is right after "9"!
+_DASH_SPRITE  = const(11)
+_SPACE_SPRITE = const(12)
+
+# Lookup table to translate byte values to sprite numbers. '0'..'9' and ':'
+# are sprites 0..10, '-' is the dash sprite, and everything else is a space.
+_XLAT = bytes([
+    (n - _ASCII_ZERO) if (_ASCII_ZERO <= n <= _ASCII_COLON) else
+    _DASH_SPRITE if (n == _ASCII_DASH) else _SPACE_SPRITE
+    for n in range(256)])
+
+
+# Digit sprites, so that extra SevenSeg instances don't load the PNG again
+_BMP = None
+_PAL = None
+
+
 class SevenSeg:
     # Simulate a 7-segment LED clock display using sprites
 
-    def __init__(self, x=0, y=0, cols=8):
+    def __init__(self, x=0, y=0, cols=8, bitmap=None, palette=None):
         # Args:
-        # - x: x coordinate of first digit's top-left corner
-        # - y: y coordinate of top line's top-left corner
-        # Load font spritesheet into Bitmap and Palette objects
+        # -       x: x coordinate of first digit's top-left corner
+        # -       y: y coordinate of top line's top-left corner
+        # -    cols: number of digits in the display
+        # -  bitmap: optional digit Bitmap to reuse (skips loading the file)
+        # - palette: digit Palette to go with bitmap (pass both or neither)
+        #
+        # Load the digit sprites, unless they were passed in or already loaded
         #
         # CAUTION 1: This uses adafruit_imageload.load() with a PNG file, and
         # the PNG loader currently has a bug where sprites are misaligned by
@@ -28,17 +52,31 @@ class SevenSeg:
         # glitched (rows were skewed, colors were wrong, etc). The BMP file was
         # about 14KB, so maybe it overflowed a buffer or something? Not sure.
         #
-        gc.collect()
-        (bmp, pal) = adafruit_imageload.load(
-            "digit-sprites.png", bitmap=Bitmap, palette=Palette)
-        gc.collect()
+        global _BMP, _PAL
+        if (bitmap is None) != (palette is None):
+            raise ValueError("bitmap and palette must be passed together")
+        if bitmap is None:
+            if _BMP is None:
+                gc.collect()
+                (_BMP, _PAL) = adafruit_imageload.load(
+                    "digit-sprites.png", bitmap=Bitmap, palette=Palette)
+                gc.collect()
+            (bitmap, palette) = (_BMP, _PAL)
         # Make a Group with TileGrids with top left corner at (x, y)
         tg = TileGrid(
-            bmp, pixel_shader=pal, width=cols, height=1,
+            bitmap, pixel_shader=palette, width=cols, height=1,
             tile_width=30, tile_height=50, x=x, y=y, default_tile=12)
         gc.collect()
         self.tg = tg
         self.cols = cols
+        # Shadow copy of the sprite numbers the TileGrid currently shows
+        # (all spaces, matching default_tile). Comparing against this is
+        # cheaper than reading the TileGrid back through displayio.
+        self._prev = bytearray([_SPACE_SPRITE] * cols)
+        # Row buffer for building sprite numbers before comparing them
+        self._row = bytearray(cols)
+        # True once setDigits() changes a digit, until the display refreshes
+        self.dirty = False
         g = Group(scale=1)
         g.append(tg)
         self.grp = g
@@ -47,32 +85,42 @@ class SevenSeg:
         return self.grp
 
     def setDigits(self, digits):
-        # Show message left-aligned on the top or bottom character LCD.
-        # - digits: string or bytes in the set: "0123456789: "
+        # Show digits left-aligned on the 7-segment display.
+        # - digits: bytes (or string) in the set: "0123456789:- "
         #
-        ASCII_SPACE = const(32)
-        ASCII_DASH  = const(45)
-        ASCII_ZERO  = const(48)
-        ASCII_COLON = const(58)  # conveniently, ASCII ":" is right after "9"!
-        _DASH_SPRITE  = const(11)
-        _SPACE_SPRITE = const(12)
         _tg = self.tg
+        _prev = self._prev
+        _row = self._row
         _cols = self.cols
+        _ord = ord
+        _xlat = _XLAT
 
-        # Set sprites for characters of the message (max length = self.cols)
-        for (i, char) in zip(range(_cols), digits):
-            # Convert the character to a sprite number and update the TileGrid
-            n = char if (type(char) == int) else ord(char)
-            sprite = _SPACE_SPRITE                        # default: ' '
-            if (ASCII_ZERO <= n) and (n <= ASCII_COLON):  # '0'..'9' and ':'
-                sprite = n - ASCII_ZERO
-            elif n == ASCII_DASH:                         # '-'
-                sprite = _DASH_SPRITE
-            if _tg[i] != sprite:         # Avoid triggering redundant repaints
-                _tg[i] = sprite
+        # Build sprite numbers for the whole row (max length = self.cols),
+        # one sprite per character. The str vs. bytes check happens once
+        # here, outside the loops.
+        end = min(len(digits), _cols)
+        if digits.__class__ is str:
+            # Convert characters to sprite numbers by table lookup
+            for i in range(end):
+                n = _ord(digits[i])
+                _row[i] = _xlat[n] if (n < 256) else _SPACE_SPRITE
+        else:
+            # Items of bytes or bytearray are already ints
+            for i in range(end):
+                _row[i] = _xlat[digits[i]]
+        # Right padding area gets space characters
+        for i in range(end, _cols):
+            _row[i] = _SPACE_SPRITE
 
-        # Clear right padding area with space characters
-        for i in range(len(digits), _cols):
-            if _tg[i] != _SPACE_SPRITE:
-                _tg[i] = _SPACE_SPRITE
+        # Push the row to the TileGrid, but only write sprites that differ
+        # from the shadow copy (avoids triggering redundant repaints)
+        dirty = False
+        for i in range(_cols):
+            sprite = _row[i]
+            if _prev[i] != sprite:
+                _tg[i] = sprite
+                _prev[i] = sprite
+                dirty = True
+        if dirty:
+            self.dirty = True
 
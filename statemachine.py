@@ -15,17 +15,14 @@
 # | setCal  | cal+1  | cal-1  | setSec  | setYr   | setYr   | hhmm | hhmm    |
 #
 # Related documentation:
-# - https://docs.circuitpython.org/projects/datetime/en/latest/api.html
 # - https://docs.circuitpython.org/en/latest/shared-bindings/time/index.html#time.mktime
 #
 from micropython import const
-from time import mktime
-
-from adafruit_datetime import datetime, timedelta
+from time import localtime, mktime
 
 
 # State Transition Constants (private)
-# CAUTION: These values must match row indexes of StateMachine.TABLE
+# CAUTION: These values must match row indexes of _TABLE
 _HHMM    = const(0)
 _MMSS    = const(1)
 _SetYr   = const(2)
@@ -36,6 +33,8 @@ _SetSec  = const(6)
 _SetCal  = const(7)
 
 # Action Constants (private)
+# CAUTION: _YrInc.._MinDec must match the row order of _STEPS,
+# and _CalInc and _CalDec must stay the highest codes
 _NOP    = const(8)
 _YrInc  = const(9)
 _YrDec  = const(10)
@@ -49,11 +48,117 @@ _Sec00  = const(17)
 _CalInc = const(18)
 _CalDec = const(19)
 
+# Number of button columns in each row of _TABLE. This is a
+# power of 2 (the 7 buttons plus an unused column) so that checking a button
+# code's range takes just one AND with ~(_NCOLS - 1).
+_NCOLS = const(8)
+
+# The help message for Set Mode uses a special up/down arrows sprite that is
+# mapped in the sprite sheet to ASCII DEL (0x7f)
+_SET_HELP     = b"\x7f:+/-  B:Exit  A:OK"
+_SET_HELP_SEC = b"\x7f:=00  B:Exit  A:OK"
+
+# Time step sizes in seconds for the time setting actions
+_MINUTE_S = const(60)
+_HOUR_S   = const(60 * 60)
+_DAY_S    = const(24 * 60 * 60)
+_YEAR_S   = const(365 * 24 * 60 * 60)
+
+# Clamp Key Constants (private) for the time setting actions. Each one picks
+# which value from the current time gets range checked before a step.
+_KYr  = const(0)  # year
+_KDay = const(1)  # (month * 31) + day (Jan 1 = 32, Dec 31 = 403)
+_KHr  = const(2)  # hour
+_KMin = const(3)  # (hour * 60) + minute
+
+# ASCII codes used when writing digits into the updateDigits() buffer
+_ASCII_DASH = const(45)
+_ASCII_ZERO = const(48)
+
+
+# The lookup tables below live at module scope rather than in the class
+# body, so methods reach them with a global lookup instead of going
+# through self. They are immutable, so all instances can share them.
+
+# LookUp Table (private) of actions (including NOP and state transitions)
+# for possible button press events in each of the possible states. NOP is
+# short for "No OPeration", and it means to do nothing. The rows are
+# packed into one flat bytes object, so a lookup is a single index:
+# _TABLE[(state * _NCOLS) + button]. The last column ("-") is padding
+# that no button uses.
+_TABLE = bytes((
+    # UP      DOWN     LEFT      RIGHT     A         B      START     -     State
+    _NOP,    _NOP,    _MMSS,    _MMSS,    _NOP,     _HHMM, _SetHMin, _NOP,  # hhmm
+    _NOP,    _NOP,    _HHMM,    _HHMM,    _NOP,     _HHMM, _SetHMin, _NOP,  # mmss
+    _YrInc,  _YrDec,  _SetCal,  _SetMDay, _SetMDay, _HHMM, _HHMM,    _NOP,  # setYr
+    _DayInc, _DayDec, _SetYr,   _SetHour, _SetHour, _HHMM, _HHMM,    _NOP,  # setMDay
+    _HrInc,  _HrDec,  _SetMDay, _SetHMin, _SetHMin, _HHMM, _HHMM,    _NOP,  # setHour
+    _MinInc, _MinDec, _SetHour, _SetSec,  _SetSec,  _HHMM, _HHMM,    _NOP,  # setHMin
+    _Sec00,  _Sec00,  _SetHMin, _SetCal,  _SetCal,  _HHMM, _HHMM,    _NOP,  # setSec
+    _CalInc, _CalDec, _SetSec,  _SetYr,   _SetYr,   _HHMM, _HHMM,    _NOP,  # setCal
+))
+
+# LookUp Table (private) of messages for the top and bottom character LCD
+# lines when entering each state.
+# CAUTION: Row indexes must match the State Transition Constants
+_MSGS = (
+    # Top line           Bottom line       State
+    (b'',                b''           ),  # hhmm
+    (b'',                b''           ),  # mmss
+    (b'   SET       YEAR', _SET_HELP    ),  # setYr
+    (b'   SET  MONTH-DAY', _SET_HELP    ),  # setMDay
+    (b'   SET       HOUR', _SET_HELP    ),  # setHour
+    (b'   SET    MINUTES', _SET_HELP    ),  # setHMin
+    (b'   SET    SECONDS', _SET_HELP_SEC),  # setSec
+    (b'   SET    RTC CAL', _SET_HELP    ),  # setCal
+)
+
+# LookUp Table (private) of digit layouts for each state. Each row has a
+# template for all 8 digit cells, the (start, end) range of struct_time
+# fields that it shows, and the column of the first field. Fields are two
+# digits each, spaced three columns apart (leaving room for ":" or "-").
+# The setYr row (one 4 digit field) and the setCal row (RTC calibration
+# register) are special cases in updateDigits().
+# CAUTION: Row indexes must match the State Transition Constants
+_DIGITS = (
+    # Template     Start End  Col     State
+    (b'  00:00 ',  3,    5,   2),  # hhmm     like "  12:00"
+    (b'00:00:00',  3,    6,   0),  # mmss     like "12:00:01"
+    (b'   0000 ',  0,    1,   3),  # setYr    like "   2024"
+    (b'  00-00 ',  1,    3,   2),  # setMDay  like "  09-12"
+    (b'00:00:00',  3,    6,   0),  # setHour
+    (b'00:00:00',  3,    6,   0),  # setHMin
+    (b'00:00:00',  3,    6,   0),  # setSec
+    (b'      0 ',  0,    0,   6),  # setCal   like "     -1"
+)
+
+# LookUp Table (private) of steps for the time setting actions, indexed by
+# (action - _YrInc). A step adds (step or repeat step) * unit seconds, but
+# gets clamped to keep its clamp key in the range lo..hi. The limits are:
+# - Years: Don't go above 2037 because attempting to do so causes a
+#   CircuitPython long int overflow error. Note that 19 January 2038 is
+#   the Unix time 32-bit overflow date.
+#   (see https://en.wikipedia.org/wiki/Year_2038_problem ) Don't go below
+#   2001 because adafruit_pcf8523 doesn't like years below 2000.
+# - Days: Do not go past December 31 or January 1 (avoid changing year)
+# - Hours and minutes: Do not go past 23:59 or 00:00 (avoid changing day)
+_STEPS = (
+    # Key    Step  Repeat  Unit       Lo    Hi        Action
+    (_KYr,   1,    5,      _YEAR_S,   2001, 2037),  # YrInc
+    (_KYr,   -1,   -5,     _YEAR_S,   2001, 2037),  # YrDec
+    (_KDay,  1,    10,     _DAY_S,    32,   403 ),  # DayInc
+    (_KDay,  -1,   -10,    _DAY_S,    32,   403 ),  # DayDec
+    (_KHr,   1,    4,      _HOUR_S,   0,    23  ),  # HrInc
+    (_KHr,   -1,   -4,     _HOUR_S,   0,    23  ),  # HrDec
+    (_KMin,  1,    10,     _MINUTE_S, 0,    1439),  # MinInc
+    (_KMin,  -1,   -10,    _MINUTE_S, 0,    1439),  # MinDec
+)
+
 
 class StateMachine:
 
     # Button Press Constants (public)
-    # CAUTION: These values must match column indexes of StateMachine.TABLE
+    # CAUTION: These values must match column indexes of _TABLE
     UP    = const(0)
     DOWN  = const(1)
     LEFT  = const(2)
@@ -62,20 +167,10 @@ class StateMachine:
     B     = const(5)
     START = const(6)
 
-    # LookUp Table (private) of actions (including NOP and state transitions)
-    # for possible button press events in each of the possible states. NOP is
-    # short for "No OPeration", and it means to do nothing.
-    _TABLE = (
-        # UP      DOWN     LEFT      RIGHT     A         B      START       State
-        (_NOP,    _NOP,    _MMSS,    _MMSS,    _NOP,     _HHMM, _SetHMin),  # hhmm
-        (_NOP,    _NOP,    _HHMM,    _HHMM,    _NOP,     _HHMM, _SetHMin),  # mmss
-        (_YrInc,  _YrDec,  _SetCal,  _SetMDay, _SetMDay, _HHMM, _HHMM   ),  # setYr
-        (_DayInc, _DayDec, _SetYr,   _SetHour, _SetHour, _HHMM, _HHMM   ),  # setMDay
-        (_HrInc,  _HrDec,  _SetMDay, _SetHMin, _SetHMin, _HHMM, _HHMM   ),  # setHour
-        (_MinInc, _MinDec, _SetHour, _SetSec,  _SetSec,  _HHMM, _HHMM   ),  # setHMin
-        (_Sec00,  _Sec00,  _SetHMin, _SetCal,  _SetCal,  _HHMM, _HHMM   ),  # setSec
-        (_CalInc, _CalDec, _SetSec,  _SetYr,   _SetYr,   _HHMM, _HHMM   ),  # setCal
-    )
+    # handleGamepad() Return Code Constants (public). These are bit flags, so
+    # callers can OR several results together.
+    REDRAW  = const(1)  # state changed: redraw digits from the cached time
+    RTC_SET = const(2)  # RTC time changed: read the RTC again, then redraw
 
     def __init__(self, digits, charLCD, rtc):
         # Save references to character LCD display, digits display, and RTC
@@ -84,181 +179,147 @@ class StateMachine:
         self.rtc = rtc
         # Start in the state for Clock Mode with hours and minutes sub-mode
         self.state = _HHMM
+        # Buffer that updateDigits() writes digits into (one byte per cell)
+        self._buf = bytearray(8)
+        # Packed fields of the last text formatted by updateDigits() for the
+        # slow changing part of a clock mode display (hours and minutes for
+        # hhmm, or the date for mmss), or -1 to force formatting it again
+        self._memo = -1
+        # Count of out of range button codes (check it from the REPL)
+        self.badButtons = 0
 
     def updateDigits(self, st):
         # Update clock digits from current state and struct_time object, st.
         # struct_time(tm_year, tm_mon, tm_mday, tm_hour, tm_min, tm_sec,
         #     tm_wday, tm_yday, tm_isdst)
-        _setD = self.digits.setDigits
-        _setM = self.charLCD.setMsg
+        # Fields are read by index (st[3] is tm_hour, etc.) because that's a
+        # cheaper lookup than the tm_* attribute names.
         s = self.state
+        # The digits get written into a preallocated bytearray, so updating
+        # them allocates nothing. The clock modes also skip updates for text
+        # that hasn't changed since last time.
         if (s == _HHMM):
-            # Simple clock like, "12:00"
-            _setD('  %02d:%02d' % (st.tm_hour, st.tm_min))
+            # Simple clock (changes once per minute)
+            memo = (st[3] << 6) | st[4]
+            if memo == self._memo:
+                return
+            self._memo = memo
         elif (s == _MMSS):
             # Full date and time like, "2024-09-12 12:00:01"
-            _setM('%04d-%02d-%02d' % (st.tm_year, st.tm_mon, st.tm_mday))
-            _setD('%02d:%02d:%02d' % (st.tm_hour, st.tm_min, st.tm_sec))
-        elif (s == _SetHour) or (s == _SetHMin) or (s == _SetSec):
-            # for setting hours, minutes, or seconds like, "12:00:01"
-            _setD('%02d:%02d:%02d' % (st.tm_hour, st.tm_min, st.tm_sec))
-        elif (s == _SetYr):
-            # for setting the year
-            _setD('   %04d' % (st.tm_year))
-        elif (s == _SetMDay):
-            # for setting the month and day
-            _setD('  %02d-%02d' % (st.tm_mon, st.tm_mday))
+            (year, month, day) = (st[0], st[1], st[2])
+            memo = (year << 9) | (month << 5) | day
+            if memo != self._memo:
+                self._memo = memo
+                self.charLCD.setMsg(b'%04d-%02d-%02d' % (year, month, day))
+        # Fill in the digits for this state from its row of the _DIGITS
+        # table. Copying a template of the same length doesn't resize buf.
+        (template, start, end, col) = _DIGITS[s]
+        buf = self._buf
+        buf[:] = template
+        if (s == _SetYr):
+            n = st[0] // 100
+            buf[col] = _ASCII_ZERO + (n // 10)
+            buf[col + 1] = _ASCII_ZERO + (n % 10)
+            n = st[0] % 100
+            buf[col + 2] = _ASCII_ZERO + (n // 10)
+            buf[col + 3] = _ASCII_ZERO + (n % 10)
         elif (s == _SetCal):
             # for setting the PCF8523 real time clock calibration register
-            _setD('     %+2d' % self.rtc.calibration)
+            # (range is -5..+5, and the 7-segment font has no "+")
+            n = self.rtc.calibration
+            if n < 0:
+                buf[col - 1] = _ASCII_DASH
+                n = -n
+            buf[col] = _ASCII_ZERO + n
+        else:
+            for i in range(start, end):
+                n = st[i]
+                buf[col] = _ASCII_ZERO + (n // 10)
+                buf[col + 1] = _ASCII_ZERO + (n % 10)
+                col += 3
+        self.digits.setDigits(buf)
 
     def handleGamepad(self, button, repeat):
         # Handle a button press event
         # args:
         # - button: one of the button constants
         # - repeat: True if this is a hold-time triggered repeating event
+        # Returns: 0 if nothing changed, REDRAW if the state (or the RTC
+        #   calibration) changed, or RTC_SET if the RTC's time changed
 
         # Check lookup table for the response code for this button event
-        if button < UP or button > START:
-            print("Button value out of range:", button)
-            return
-        r = self._TABLE[self.state][button]
+        if button & ~(_NCOLS - 1):
+            self.badButtons += 1
+            return 0
+        r = _TABLE[(self.state * _NCOLS) + button]
+
+        # NOP is the most common response (most buttons do nothing in the
+        # clock modes), so test for it first, before caching any names
+        if r == _NOP:
+            return 0
 
         # Cache frequently used names to reduce time used by dictionary lookups
         _rtc = self.rtc
         _setM = self.charLCD.setMsg
-        _fromtimestamp = datetime.fromtimestamp
 
-        # The help message for Set Mode uses a special up/down arrows sprite
-        # that is mapped in the sprite sheet to ASCII DEL (0x7f)
-        SET_HELP     = b"\x7f:+/-  B:Exit  A:OK"
-        SET_HELP_SEC = b"\x7f:=00  B:Exit  A:OK"
-
-        # Handle the response code
-        # First, check for state transition codes
-        if r == _HHMM:
-            self.state = r
-            _setM(b'')
-            _setM(b'', top=False)
-        elif r == _MMSS:
-            self.state = r
-            _setM(b'')
-            _setM(b'', top=False)
-        elif r == _SetYr:
+        # Handle the other response codes
+        # First, check for state transition codes (these are the lowest
+        # codes, 0 to _SetCal). Entering a state shows its messages.
+        if r <= _SetCal:
             self.state = r
-            _setM(b'   SET       YEAR')
-            _setM(SET_HELP, top=False)
-        elif r == _SetMDay:
-            self.state = r
-            _setM(b'   SET  MONTH-DAY')
-            _setM(SET_HELP, top=False)
-        elif r == _SetHour:
-            self.state = r
-            _setM(b'   SET       HOUR')
-            _setM(SET_HELP, top=False)
-        elif r == _SetHMin:
-            self.state = r
-            _setM(b'   SET    MINUTES')
-            _setM(SET_HELP, top=False)
-        elif r == _SetSec:
-            self.state = r
-            _setM(b'   SET    SECONDS')
-            _setM(SET_HELP_SEC, top=False)
-        elif r == _SetCal:
-            self.state = r
-            _setM(b'   SET    RTC CAL')
-            _setM(SET_HELP, top=False)
+            if r <= _MMSS:
+                self._memo = -1  # clock modes must format all their text
+            (top, bottom) = _MSGS[r]
+            _setM(top)
+            _setM(bottom, top=False)
 
-        # Second, check for action codes that don't change the state
-        elif r == _NOP:
-            return
+        # Second, check for action codes that adjust the RTC calibration.
+        # These don't need the date and time, so handle them before paying
+        # for an RTC read and the mktime()/localtime() round trip. Also,
+        # updateDigits() reads the calibration register itself, so these
+        # only need REDRAW.
+        elif r >= _CalInc:
+            # Increment (_CalInc) or decrement (_CalDec) the PCF8523
+            # calibration register, staying within its limits of -5..+5
+            cal = _rtc.calibration + (1 if (r == _CalInc) else -1)
+            if -5 <= cal <= 5:
+                _rtc.calibration = cal
 
         # Third, check for action codes that modify the RTC date or time
         else:
-            # To avoid surprising things like unintentionally changing the day
-            # when you're trying to set the minutes (e.g. crossing midnight),
-            # we need a struct_time object. But, to do math with time deltas in
-            # a way that accounts for leap years, days per month, etc., we need
-            # a datetime object. So, make both:
+            # The struct_time fields give the clamp keys that keep a step from
+            # changing more than it should (e.g. crossing midnight into the
+            # next day while setting the minutes). The step gets added to the
+            # mktime() timestamp (int seconds), so leap years, days per month,
+            # etc. come out right when localtime() turns the sum back into a
+            # struct_time for the RTC. So, make both:
             st = _rtc.datetime                  # struct_time
-            now = _fromtimestamp(mktime(st))    # datetime
-            # Unpack the struct_time with shorter names
-            (year, month, day) = (st.tm_year, st.tm_mon, st.tm_mday)
-            (hour, min_, sec) = (st.tm_hour, st.tm_min, st.tm_sec)
-
-            if r == _YrInc:
-                # Increment Year
-                n = 5 if repeat else 1
-                if year + n > 2037:
-                    # Don't go above 2037 because attempting to do so causes
-                    # a CircuitPython long int overflow error. Note that
-                    # 19 January 2038 is the Unix time 32-bit overflow date.
-                    # see https://en.wikipedia.org/wiki/Year_2038_problem
-                    n = 2037 - year
-                _rtc.datetime = (now + timedelta(days=(n*365))).timetuple()
-            elif r == _YrDec:
-                # Decrement Year
-                n = -5 if repeat else -1
-                if year + n < 2001:
-                    # Don't go below 2001 because adafruit_pcf8523 doesn't like
-                    # years below 2000
-                    n = 2001 - year
-                _rtc.datetime = (now + timedelta(days=(n*365))).timetuple()
-            elif r == _DayInc:
-                # Increment Day
-                n = 10 if repeat else 1
-                if (month == 12) and (day + n > 31):
-                    # Do not go past December 31 (avoid changing year)
-                    n = 31 - day
-                _rtc.datetime = (now + timedelta(days=n)).timetuple()
-            elif r == _DayDec:
-                # Decrement Day
-                n = -10 if repeat else -1
-                if (month == 1) and (day + n < 1):
-                    # Do not go past January 1 (avoid changing year)
-                    n = 1 - day
-                _rtc.datetime = (now + timedelta(days=n)).timetuple()
-            elif r == _HrInc:
-                # Increment Hour
-                n = 4 if repeat else 1
-                if hour + n > 23:
-                    # Do not go past 23:xx (avoid changing day)
-                    n = 23 - hour
-                _rtc.datetime = (now + timedelta(hours=n)).timetuple()
-            elif r == _HrDec:
-                # Decrement Hour
-                n = -4 if repeat else -1
-                if hour + n < 0:
-                    # Do not go past 00:xx (avoid changing day)
-                    n = 0 - hour
-                _rtc.datetime = (now + timedelta(hours=n)).timetuple()
-            elif r == _MinInc:
-                # Increment Minute
-                n = 10 if repeat else 1
-                if (hour == 23) and (min_ + n > 59):
-                    # Do not go past 23:59 (avoid changing day)
-                    n = 59 - min_
-                _rtc.datetime = (now + timedelta(minutes=n)).timetuple()
-            elif r == _MinDec:
-                # Decrement Minute
-                n = -10 if repeat else -1
-                if (hour == 0) and (min_ + n < 0):
-                    # Do not go past 00:00 (avoid changing day)
-                    n = 00 - min_
-                _rtc.datetime = (now + timedelta(minutes=n)).timetuple()
-            elif r == _Sec00:
-                # Round seconds to nearest minute
-                delta = -(sec) if (sec <= 30) else (60-sec)
-                _rtc.datetime = (now + timedelta(seconds=delta)).timetuple()
+            now = mktime(st)                    # int seconds
+            if r == _Sec00:
+                # Round seconds to nearest minute. (sec > 30) is 0 or 1, so
+                # this adds 60 only when rounding up, with no branch.
+                sec = st[5]
+                delta = (60 * (sec > 30)) - sec
                 # Print number of seconds of drift adjustment (for calibration)
                 print("drift adjustment:", delta, "s")
-            elif r == _CalInc:
-                # Increment PCF8523 calibration register (upper limit: +5)
-                cal = _rtc.calibration
-                if cal < 5:
-                    _rtc.calibration = cal + 1
-            elif r == _CalDec:
-                # Decrement PCF8523 calibration register (lower limit: -5)
-                cal = _rtc.calibration
-                if cal > -5:
-                    _rtc.calibration = cal - 1
+            else:
+                # Look up the step, then clamp it to stay within range
+                (kind, step, rstep, unit, lo, hi) = _STEPS[r - _YrInc]
+                n = rstep if repeat else step
+                # (st indexes: 0 = year, 1 = month, 2 = day, 3 = hour, 4 = min)
+                if kind == _KYr:
+                    key = st[0]
+                elif kind == _KDay:
+                    key = (st[1] * 31) + st[2]
+                elif kind == _KHr:
+                    key = st[3]
+                else:
+                    key = (st[3] * 60) + st[4]
+                if key + n > hi:
+                    n = hi - key
+                elif key + n < lo:
+                    n = lo - key
+                delta = n * unit
+            _rtc.datetime = localtime(now + delta)
+            return RTC_SET
+        return REDRAW